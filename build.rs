@@ -341,6 +341,9 @@ fn write_format_tables(w: &mut impl Write) -> Result<(), std::io::Error> {
 }
 
 fn main() -> Result<(), Box<dyn Error>> {
+    // Makes cfg(Py_LIMITED_API) etc. available
+    pyo3_build_config::use_pyo3_cfgs();
+
     let out_dir = std::env::var_os("OUT_DIR").unwrap();
     let out_path = Path::new(&out_dir);
     let tables_path = out_path.join("tables.rs");
@@ -16,10 +16,6 @@
 use enum_map::Enum;
 
 /// Type of katcp message
-#[cfg_attr(
-    feature = "pyo3",
-    pyo3::pyclass(module = "katcp_codec._lib", rename_all = "SCREAMING_SNAKE_CASE")
-)]
 #[derive(Copy, Clone, Eq, PartialEq, Debug, Hash)]
 pub enum MessageType {
     Request = 1,
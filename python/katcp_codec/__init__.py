@@ -16,16 +16,16 @@
 
 import enum
 import re
-from dataclasses import InitVar, dataclass, field
-from typing import List, Optional, Union
+from typing import Callable, List, Optional, Union
 
 from . import _lib
 
 _NAME_RE = re.compile(b"[A-Za-z][-A-Za-z0-9]*")
 
 
-# Note: the values must correspond to those in message.rs
-class MessageType(enum.Enum):
+# Note: the names must correspond to those in binding.rs, and the values to
+# those in crates/fsm/src/lib.rs.
+class MessageType(enum.IntEnum):
     """Type of katcp message."""
 
     REQUEST = 1
@@ -33,17 +33,24 @@ class MessageType(enum.Enum):
     INFORM = 3
 
 
-_MESSAGE_TYPE_MAP = {
-    MessageType.REQUEST: _lib.MessageType.REQUEST,
-    MessageType.REPLY: _lib.MessageType.REPLY,
-    MessageType.INFORM: _lib.MessageType.INFORM,
-}
-
-
-@dataclass
 class Message:
     """A katcp message.
 
+    Parameters
+    ----------
+    mtype
+        Message type
+    name
+        Message name
+    mid
+        Message ID, or ``None`` if there isn't one
+    arguments
+        Message arguments
+    validate
+        If false, skip validating the name and message ID. This should only be
+        done if they've already been checked, as the behaviour is undefined if
+        they're invalid.
+
     Raises
     ------
     OverflowError
@@ -52,8 +59,8 @@ class Message:
         if the name does not conform to the specification
     """
 
-    # Python 3.8 doesn't support the `slots=True` parameter to dataclass, so
-    # we have to specify the slots manually.
+    # Note: the parser constructs messages without calling __init__, by
+    # assigning these attributes (see new_message in binding.rs).
     __slots__ = ["mtype", "name", "mid", "arguments"]
 
     #: Message type
@@ -64,45 +71,45 @@ class Message:
     mid: Optional[int]
     #: Message arguments
     arguments: List[bytes]
-    #: If false, skip validating the name and message ID. This should only be
-    #: done if they've already been checked, as the behaviour is undefined if
-    #: they're invalid.
-    validate: InitVar[bool] = field(default=True)
-
-    def __post_init__(self, validate: bool) -> None:
-        if not validate:
-            return
-        if self.mid is not None and not 1 <= self.mid <= 2**31 - 1:
-            raise OverflowError("Message ID must be in the range [1, 2**31 - 1]")
-        if not _NAME_RE.fullmatch(self.name):
-            raise ValueError("Name is invalid")
 
-    def __bytes__(self) -> bytes:
-        """Convert the message to its wire representation."""
-        return bytes(_message_to_rust(self))
-
-
-def _message_from_rust(
-    message: Union[_lib.Message, ValueError]
-) -> Union[Message, ValueError]:
-    if isinstance(message, ValueError):
-        return message
-    else:
-        return Message(
-            MessageType(int(message.mtype)),
-            message.name,
-            message.mid,
-            message.arguments,
+    def __init__(
+        self,
+        mtype: MessageType,
+        name: bytes,
+        mid: Optional[int],
+        arguments: List[bytes],
+        validate: bool = True,
+    ) -> None:
+        if validate:
+            if mid is not None and not 1 <= mid <= 2**31 - 1:
+                raise OverflowError("Message ID must be in the range [1, 2**31 - 1]")
+            if not _NAME_RE.fullmatch(name):
+                raise ValueError("Name is invalid")
+        self.mtype = mtype
+        self.name = name
+        self.mid = mid
+        self.arguments = arguments
+
+    def __repr__(self) -> str:
+        return (
+            f"Message(mtype={self.mtype!r}, name={self.name!r}, "
+            f"mid={self.mid!r}, arguments={self.arguments!r})"
         )
 
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        assert isinstance(other, Message)  # To keep mypy happy
+        return (self.mtype, self.name, self.mid, self.arguments) == (
+            other.mtype,
+            other.name,
+            other.mid,
+            other.arguments,
+        )
 
-def _message_to_rust(message: Message) -> _lib.Message:
-    return _lib.Message(
-        _MESSAGE_TYPE_MAP[message.mtype],
-        message.name,
-        message.mid,
-        message.arguments,
-    )
+    def __bytes__(self) -> bytes:
+        """Convert the message to its wire representation."""
+        return _lib.format_message(self.mtype, self.name, self.mid, self.arguments)
 
 
 class Parser:
@@ -111,6 +118,11 @@ class Parser:
     The parser accepts chunks of data from the wire (which need not be aligned
     to message boundaries) and returns whole messages as they are parsed.
 
+    A parser must not be used from several threads at once. Large inputs are
+    parsed without holding the GIL, so a concurrent call on the same parser
+    from another thread may raise :exc:`RuntimeError` rather than waiting.
+    Separate parsers can be used concurrently.
+
     Parameters
     ----------
     max_line_length
@@ -121,9 +133,20 @@ class Parser:
     def __init__(self, max_line_length: int) -> None:
         self._parser = _lib.Parser(max_line_length)
 
-    def append(self, data: bytes) -> List[Union[Message, ValueError]]:
+    def append(
+        self, data: Union[bytes, bytearray, memoryview]
+    ) -> List[Union[Message, ValueError]]:
         """Append new data to the parser.
 
+        Parameters
+        ----------
+        data
+            New data from the wire. This may be any object supporting the
+            buffer protocol. :class:`bytes` objects are parsed without first
+            being copied. Other objects are generally copied (contiguous
+            memoryviews of :class:`bytes` are also used in place, except in
+            the ``abi3`` wheels).
+
         Returns
         -------
         messages
@@ -131,7 +154,24 @@ class Parser:
             an instance of :class:`Message` if it was valid or
             :exc:`ValueError` if not.
         """
-        return [_message_from_rust(message) for message in self._parser.append(data)]
+        return self._parser.append(data)
+
+    def append_into(
+        self,
+        data: Union[bytes, bytearray, memoryview],
+        callback: Callable[[Union[Message, ValueError]], object],
+    ) -> None:
+        """Append new data to the parser, passing each message to a callback.
+
+        This is equivalent to calling `callback` on each element returned by
+        :meth:`append`, but avoids constructing the list.
+
+        If `callback` raises an exception, it propagates to the caller and
+        any remaining messages from `data` are discarded. The parser is
+        left in a consistent state, as if all of `data` had been appended.
+        The callback must not call methods of this parser.
+        """
+        self._parser.append_into(data, callback)
 
     def reset(self) -> None:
         """Reset the parser to its initial state.
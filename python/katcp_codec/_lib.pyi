@@ -14,35 +14,25 @@
 # limitations under the License.
 ################################################################################
 
-from typing import Final, List, Optional, Union
+from typing import Callable, List, Optional, Union
 
-# Not inherited from enum.Enum, because Pyo3 doesn't provide full compatibility.
-class MessageType:
-    REQUEST: Final[MessageType] = ...
-    REPLY: Final[MessageType] = ...
-    INFORM: Final[MessageType] = ...
+import katcp_codec
+from katcp_codec import MessageType
 
-    def __int__(self) -> int: ...
-
-class Message:
-    mtype: MessageType
-    name: bytes
-    mid: Optional[int]
-    arguments: List[bytes]
-
-    # TODO: does it have to be List, or would Iterable work?
-    def __init__(
-        self,
-        mtype: MessageType,
-        name: bytes,
-        mid: Optional[int],
-        arguments: List[bytes],
-    ) -> None: ...
-    def __bytes__(self) -> bytes: ...
+def format_message(
+    mtype: MessageType, name: bytes, mid: Optional[int], arguments: List[bytes]
+) -> bytes: ...
 
 class Parser:
     def __init__(self, max_line_length: int) -> None: ...
-    def append(self, data: bytes) -> List[Union[Message, ValueError]]: ...
+    def append(
+        self, data: Union[bytes, bytearray, memoryview]
+    ) -> List[Union[katcp_codec.Message, ValueError]]: ...
+    def append_into(
+        self,
+        data: Union[bytes, bytearray, memoryview],
+        callback: Callable[[Union[katcp_codec.Message, ValueError]], object],
+    ) -> None: ...
     def reset(self) -> None: ...
     @property
     def buffer_size(self) -> int: ...
@@ -31,6 +31,10 @@ def test_bad_name(name: bytes) -> None:
         Message(MessageType.REQUEST, name, None, [])
 
 
+def test_integer_mtype() -> None:
+    assert bytes(Message(2, b"hello", None, [])) == b"!hello\n"  # type: ignore
+
+
 @pytest.mark.parametrize(
     "message, encoding",
     [
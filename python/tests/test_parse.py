@@ -14,7 +14,8 @@
 # limitations under the License.
 ################################################################################
 
-from typing import List
+import concurrent.futures
+from typing import List, Union
 
 import pytest
 
@@ -55,6 +56,116 @@ def test_success(parser: Parser, data: bytes, messages: List[Message]) -> None:
     assert parser.append(data) == messages
 
 
+@pytest.mark.parametrize(
+    "data",
+    [
+        bytearray(b"?hello world\n"),
+        memoryview(b"?hello world\n"),
+        memoryview(bytearray(b"?hello world\n")),
+        memoryview(bytearray(b"?hello world\n")).toreadonly(),  # Mutable exporter
+        memoryview(b"?-h-e-l-l-o- -w-o-r-l-d-\n-")[::2],  # Non-contiguous
+        memoryview(b"?hello world\n").cast("b"),  # Not format "B"
+        memoryview(b"?hello world\n\n\n\n").cast("I"),  # Item size is not 1
+    ],
+)
+def test_buffer_protocol(parser: Parser, data: Union[bytearray, memoryview]) -> None:
+    assert parser.append(data) == [
+        Message(MessageType.REQUEST, b"hello", None, [b"world"])
+    ]
+
+
+def test_not_buffer(parser: Parser) -> None:
+    with pytest.raises(TypeError):
+        parser.append("?hello world\n")  # type: ignore
+
+
+def test_large(parser: Parser) -> None:
+    # Large enough to take the code path that releases the GIL
+    data = b"#log hello world\n" * 1000
+    message = Message(MessageType.INFORM, b"log", None, [b"hello", b"world"])
+    assert parser.append(data) == [message] * 1000
+
+
+def test_large_threads(max_line_length: int) -> None:
+    # Separate parsers parsing large inputs concurrently must not interfere
+    data = b"#log hello world\n" * 1000
+    message = Message(MessageType.INFORM, b"log", None, [b"hello", b"world"])
+
+    def work() -> List[Union[Message, ValueError]]:
+        parser = Parser(max_line_length)
+        messages = []
+        for _ in range(20):
+            messages.extend(parser.append(data))
+        return messages
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(work) for _ in range(4)]
+        for future in futures:
+            assert future.result() == [message] * 20000
+
+
+def test_repeated_name(parser: Parser) -> None:
+    messages = parser.append(b"#log a\n#other\n#log b\n")
+    assert messages == [
+        Message(MessageType.INFORM, b"log", None, [b"a"]),
+        Message(MessageType.INFORM, b"other", None, []),
+        Message(MessageType.INFORM, b"log", None, [b"b"]),
+    ]
+    # The name should be reused rather than allocated again
+    assert isinstance(messages[0], Message)
+    assert isinstance(messages[2], Message)
+    assert messages[0].name is messages[2].name
+
+
+def test_repeated_mid(parser: Parser) -> None:
+    messages = parser.append(b"#log[1000] a\n#log[1001] b\n!log[1000] ok\n")
+    assert messages == [
+        Message(MessageType.INFORM, b"log", 1000, [b"a"]),
+        Message(MessageType.INFORM, b"log", 1001, [b"b"]),
+        Message(MessageType.REPLY, b"log", 1000, [b"ok"]),
+    ]
+    # The message ID should be reused rather than allocated again
+    assert isinstance(messages[0], Message)
+    assert isinstance(messages[2], Message)
+    assert messages[0].mid is messages[2].mid
+
+
+def test_append_into(parser: Parser) -> None:
+    messages: List[Union[Message, ValueError]] = []
+    parser.append_into(b"?hello world\n!reply[2] \\@\n", messages.append)
+    assert messages == [
+        Message(MessageType.REQUEST, b"hello", None, [b"world"]),
+        Message(MessageType.REPLY, b"reply", 2, [b""]),
+    ]
+
+
+def test_append_into_raise(parser: Parser) -> None:
+    def callback(message: Union[Message, ValueError]) -> None:
+        raise RuntimeError("test error")
+
+    with pytest.raises(RuntimeError, match="test error"):
+        parser.append_into(b"?first\n?second\n?third", callback)
+    # The rest of the data must still have been consumed
+    assert parser.append(b"\n") == [Message(MessageType.REQUEST, b"third", None, [])]
+
+
+def test_append_into_mutate(parser: Parser) -> None:
+    data = bytearray(b"#first x\n#second y\n")
+    messages: List[Union[Message, ValueError]] = []
+
+    def callback(message: Union[Message, ValueError]) -> None:
+        # Modify the data in place (without resizing it) while the parser
+        # still has results to deliver from it.
+        data[:] = bytes(len(data))
+        messages.append(message)
+
+    parser.append_into(memoryview(data).toreadonly(), callback)
+    assert messages == [
+        Message(MessageType.INFORM, b"first", None, [b"x"]),
+        Message(MessageType.INFORM, b"second", None, [b"y"]),
+    ]
+
+
 def test_buffer_size(parser: Parser) -> None:
     assert parser.buffer_size == 0
     parser.append(b"?hello world")
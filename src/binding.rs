@@ -13,15 +13,100 @@
  * limitations under the License.
  */
 
+use pyo3::exceptions::{PyTypeError, PyValueError};
+use pyo3::intern;
 use pyo3::prelude::*;
+use pyo3::sync::GILOnceCell;
+use pyo3::types::{PyBytes, PyList};
 
-use crate::message::{MessageType, PyMessage};
-use crate::parse::Parser;
+use crate::message::{py_format_message, MessageType};
+use crate::parse::PyParser;
+
+// Objects from the Python katcp_codec package. They're looked up on first
+// use rather than at module initialisation, because katcp_codec imports this
+// module.
+static MESSAGE: GILOnceCell<PyObject> = GILOnceCell::new();
+static MESSAGE_NEW: GILOnceCell<PyObject> = GILOnceCell::new();
+// Members of katcp_codec.MessageType, indexed by the value minus one
+static MESSAGE_TYPES: GILOnceCell<[PyObject; 3]> = GILOnceCell::new();
+
+/// Variants of [MessageType], in the same order as [MESSAGE_TYPES].
+const MESSAGE_TYPE_VARIANTS: [MessageType; 3] = [
+    MessageType::Request,
+    MessageType::Reply,
+    MessageType::Inform,
+];
+
+/// Get the Python `katcp_codec.Message` class.
+fn message_class(py: Python<'_>) -> PyResult<&'static PyObject> {
+    MESSAGE.get_or_try_init(py, || {
+        Ok(py.import_bound("katcp_codec")?.getattr("Message")?.unbind())
+    })
+}
+
+/// Construct a Python `katcp_codec.Message` without calling its `__init__`.
+///
+/// The attributes are assigned directly, which avoids the overhead of
+/// executing the Python constructor. It does no validation, so the caller
+/// must ensure that the name and message ID are valid.
+pub(crate) fn new_message(
+    py: Python<'_>,
+    mtype: MessageType,
+    name: Bound<'_, PyBytes>,
+    mid: PyObject,
+    arguments: Bound<'_, PyList>,
+) -> PyResult<PyObject> {
+    let cls = message_class(py)?;
+    let new = MESSAGE_NEW.get_or_try_init(py, || cls.getattr(py, "__new__"))?;
+    let message = new.bind(py).call1((cls,))?;
+    message.setattr(intern!(py, "mtype"), message_type_to_py(py, mtype)?)?;
+    message.setattr(intern!(py, "name"), name)?;
+    message.setattr(intern!(py, "mid"), mid)?;
+    message.setattr(intern!(py, "arguments"), arguments)?;
+    Ok(message.unbind())
+}
+
+/// Get the members of the Python `katcp_codec.MessageType` enum.
+fn message_types(py: Python<'_>) -> PyResult<&'static [PyObject; 3]> {
+    MESSAGE_TYPES.get_or_try_init(py, || {
+        let cls = py.import_bound("katcp_codec")?.getattr("MessageType")?;
+        Ok([
+            cls.getattr("REQUEST")?.unbind(),
+            cls.getattr("REPLY")?.unbind(),
+            cls.getattr("INFORM")?.unbind(),
+        ])
+    })
+}
+
+/// Get the member of the Python `katcp_codec.MessageType` enum corresponding to `mtype`.
+fn message_type_to_py(py: Python<'_>, mtype: MessageType) -> PyResult<&'static PyObject> {
+    Ok(&message_types(py)?[mtype as usize - 1])
+}
+
+/// Convert a member of the Python `katcp_codec.MessageType` enum to [MessageType].
+///
+/// Since the enum is an `IntEnum`, the equivalent integers are also accepted.
+pub(crate) fn message_type_from_py(value: &Bound<'_, PyAny>) -> PyResult<MessageType> {
+    // Fast path: compare by identity
+    for (mtype, member) in MESSAGE_TYPE_VARIANTS.iter().zip(message_types(value.py())?) {
+        if value.is(member) {
+            return Ok(*mtype);
+        }
+    }
+    let value: i64 = value
+        .extract()
+        .map_err(|_| PyTypeError::new_err("mtype must be a MessageType"))?;
+    match value {
+        1..=3 => Ok(MESSAGE_TYPE_VARIANTS[value as usize - 1]),
+        _ => Err(PyValueError::new_err(format!(
+            "{value} is not a valid MessageType"
+        ))),
+    }
+}
 
 #[pymodule]
 fn _lib(m: Bound<'_, PyModule>) -> PyResult<()> {
-    m.add_class::<MessageType>()?;
-    m.add_class::<PyMessage>()?;
-    m.add_class::<Parser>()?;
+    m.add_function(wrap_pyfunction!(py_format_message, &m)?)?;
+    m.add_class::<PyParser>()?;
     Ok(())
 }
@@ -17,6 +17,7 @@ use std::ops::AddAssign;
 use uninit::prelude::*;
 
 use crate::message::{Message, MessageType};
+use crate::scan::argument_words_len;
 use crate::tables::{ESCAPE_FLAG, ESCAPE_SYMBOL};
 
 // Accumulator that panics on overflow
@@ -31,6 +32,21 @@ impl AddAssign<usize> for Accumulator {
     }
 }
 
+/// Count the bytes in `argument` that need to be escaped.
+fn escape_count(argument: &[u8]) -> usize {
+    let mut count = 0;
+    let mut pos = 0;
+    while pos < argument.len() {
+        // Skip whole words that don't need escaping
+        pos += argument_words_len(&argument[pos..]);
+        if pos < argument.len() {
+            count += ESCAPE_FLAG[argument[pos]] as usize;
+            pos += 1;
+        }
+    }
+    count
+}
+
 impl<N, A> Message<N, A>
 where
     N: AsRef<[u8]>,
@@ -94,15 +110,19 @@ where
             if argument.is_empty() {
                 target = Self::append_bytes(target, b"\\@");
             }
-            for &c in argument.iter() {
-                let esc = ESCAPE_SYMBOL[c];
-                if esc == 0 {
-                    // No escaping is needed
-                    target = Self::append_byte(target, c);
-                } else {
-                    target = Self::append_byte(target, b'\\');
-                    target = Self::append_byte(target, esc);
+            // Copy runs of characters that don't need escaping in one step
+            let mut rest = argument;
+            loop {
+                let mut run = argument_words_len(rest);
+                while run < rest.len() && !ESCAPE_FLAG[rest[run]] {
+                    run += 1;
                 }
+                target = Self::append_bytes(target, &rest[..run]);
+                if run == rest.len() {
+                    break;
+                }
+                target = Self::append_bytes(target, &[b'\\', ESCAPE_SYMBOL[rest[run]]]);
+                rest = &rest[run + 1..];
             }
         }
         Self::append_byte(target, b'\n')
@@ -128,7 +148,7 @@ where
                 bytes += 2; // For the \@
             } else {
                 bytes += argument.len();
-                bytes += argument.iter().filter(|&&c| ESCAPE_FLAG[c]).count();
+                bytes += escape_count(argument);
             }
         }
         bytes.0
@@ -154,9 +174,18 @@ where
 mod test {
     use super::*;
 
+    use proptest::prelude::*;
     use rstest::*;
     use std::cell::Cell;
 
+    proptest! {
+        #[test]
+        fn escape_count_matches(data in prop::collection::vec(any::<u8>(), 0..100)) {
+            let expected = data.iter().filter(|&&c| ESCAPE_FLAG[c]).count();
+            assert_eq!(escape_count(&data), expected);
+        }
+    }
+
     /// Create a Message that requires more than usize bytes.
     #[test]
     #[should_panic(expected = "message size should not exceed usize::MAX")]
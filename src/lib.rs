@@ -19,6 +19,7 @@ mod binding;
 pub mod format;
 pub mod message;
 pub mod parse;
+mod scan;
 mod tables;
 #[cfg(test)]
 mod test;
@@ -15,15 +15,14 @@
 
 //! The basic katcp message type
 
-use pyo3::exceptions::{PyRuntimeError, PyValueError};
-use pyo3::gc::PyVisit;
+use pyo3::exceptions::PyRuntimeError;
 use pyo3::prelude::*;
 use pyo3::pybacked::PyBackedBytes;
 use pyo3::types::{PyBytes, PyList};
-use pyo3::PyTraverseError;
-use std::borrow::Cow;
 use uninit::prelude::*;
 
+use crate::binding::message_type_from_py;
+
 pub use katcp_codec_fsm::MessageType;
 
 /// A katcp message. The name and arguments can either own their data or
@@ -89,107 +88,42 @@ where
     }
 }
 
-/// Message type used for interaction with Python.
-#[pyclass(name = "Message", module = "katcp_codec._lib", get_all, set_all)]
-pub struct PyMessage {
-    pub mtype: MessageType,
-    pub name: Option<Py<PyBytes>>, // Option only to support __clear__
-    pub mid: Option<u32>,
-    pub arguments: Option<Py<PyList>>, // Option only to support __clear__
-}
-
-impl PyMessage {
-    /// Construct a new message.
-    pub fn new(
-        mtype: MessageType,
-        name: Py<PyBytes>,
-        mid: Option<u32>,
-        arguments: Py<PyList>,
-    ) -> Self {
-        Self {
-            mtype,
-            name: Some(name),
-            mid,
-            arguments: Some(arguments),
-        }
-    }
-}
-
-#[pymethods]
-impl PyMessage {
-    #[new]
-    #[pyo3(signature = (mtype, name, mid, arguments))]
-    fn py_new<'py>(
-        mtype: MessageType,
-        name: Bound<'py, PyBytes>,
-        mid: Option<u32>,
-        arguments: Bound<'py, PyList>,
-    ) -> Self {
-        Self::new(mtype, name.unbind(), mid, arguments.unbind())
+/// Format a message from its Python attributes.
+///
+/// This is used to implement `katcp_codec.Message.__bytes__`. The
+/// attributes are passed directly, rather than wrapping them in an
+/// intermediate object.
+#[pyfunction]
+#[pyo3(name = "format_message")]
+pub fn py_format_message<'py>(
+    mtype: &Bound<'py, PyAny>,
+    name: &Bound<'py, PyBytes>,
+    mid: Option<u32>,
+    arguments: &Bound<'py, PyList>,
+) -> PyResult<Bound<'py, PyBytes>> {
+    let py = name.py();
+    // Extracting directly from the PyList (rather than with the generic
+    // sequence extraction) allows the vector to be sized up front.
+    let mut argument_bytes = Vec::with_capacity(arguments.len());
+    for argument in arguments.iter() {
+        argument_bytes.push(argument.extract::<PyBackedBytes>()?);
     }
-
-    // See https://pyo3.rs/v0.21.2/class/protocols#garbage-collector-integration
-    fn __traverse__(&self, visit: PyVisit) -> Result<(), PyTraverseError> {
-        if let Some(name) = &self.name {
-            visit.call(name)?;
-        }
-        if let Some(arguments) = &self.arguments {
-            visit.call(arguments)?;
+    let message = Message {
+        mtype: message_type_from_py(mtype)?,
+        name: name.as_bytes(),
+        mid,
+        arguments: argument_bytes,
+    };
+    let size = message.write_size();
+    PyBytes::new_bound_with(py, size, |bytes: &mut [u8]| {
+        let remain = message.write_out(bytes.as_out());
+        if !remain.is_empty() {
+            // This should be unreachable, because we hold the GIL.
+            Err(PyRuntimeError::new_err(
+                "Message changed size during formatting",
+            ))
+        } else {
+            Ok(())
         }
-        Ok(())
-    }
-
-    fn __clear__(&mut self) {
-        self.name = None;
-        self.arguments = None;
-    }
-
-    fn __bytes__<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyBytes>> {
-        let name = self
-            .name
-            .as_ref()
-            .ok_or_else(|| PyValueError::new_err("name is None"))?;
-        let name = name.bind(py);
-        let arguments = self
-            .arguments
-            .as_ref()
-            .ok_or_else(|| PyValueError::new_err("arguments is None"))?;
-        // TODO: this is creating a new vector to hold the arguments.
-        // Can we use another trait to handle directly iterating the PyList?
-        let arguments: Vec<PyBackedBytes> = arguments.bind(py).extract()?;
-        let message = Message {
-            mtype: self.mtype,
-            name: name.as_bytes(),
-            mid: self.mid,
-            arguments,
-        };
-        let size = message.write_size();
-        PyBytes::new_bound_with(py, size, |bytes: &mut [u8]| {
-            let remain = message.write_out(bytes.as_out());
-            if !remain.is_empty() {
-                // This should be unreachable, because we hold the GIL.
-                Err(PyRuntimeError::new_err(
-                    "Message changed size during formatting",
-                ))
-            } else {
-                Ok(())
-            }
-        })
-    }
-}
-
-impl<N, A> ToPyObject for Message<N, A>
-where
-    N: AsRef<[u8]>,
-    A: AsRef<[u8]>,
-{
-    fn to_object(&self, py: Python<'_>) -> PyObject {
-        let py_msg = PyMessage::new(
-            self.mtype,
-            PyBytes::new_bound(py, self.name.as_ref()).unbind(),
-            self.mid,
-            PyList::new_bound(py, self.arguments.iter().map(|x| Cow::from(x.as_ref()))).unbind(),
-        );
-        py_msg.into_py(py)
-    }
+    })
 }
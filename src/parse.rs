@@ -13,15 +13,23 @@
  * limitations under the License.
  */
 
+#[cfg(not(Py_LIMITED_API))]
+use pyo3::buffer::PyBuffer;
 use pyo3::exceptions::PyValueError;
+#[cfg(not(Py_LIMITED_API))]
+use pyo3::intern;
 use pyo3::prelude::*;
-use pyo3::types::{PyBytes, PyList};
+use pyo3::types::{PyBytes, PyList, PyMemoryView};
 use std::borrow::Cow;
+use std::cell::RefCell;
 use thiserror::Error;
 
 use katcp_codec_fsm::{Action, State};
+use memchr::memchr2;
 
+use crate::binding::new_message;
 use crate::message::{Message, MessageType};
+use crate::scan::argument_words_len;
 use crate::tables::PARSER_TABLE;
 
 type ParsedMessage<'data> = Message<Cow<'data, [u8]>, Cow<'data, [u8]>>;
@@ -79,7 +87,6 @@ struct Transient<'data> {
 ///
 /// The parser accepts chunks of data from the wire (which need not be aligned
 /// to message boundaries) and returns whole messages as they are parsed.
-#[pyclass(module = "katcp_codec._lib")]
 pub struct Parser {
     /// Current state
     state: State,
@@ -99,6 +106,72 @@ pub struct Parser {
     error: Option<ParseError>,
 }
 
+/// Maximum number of buffers held in each thread's [BUFFER_POOL]
+const BUFFER_POOL_SIZE: usize = 16;
+/// Largest buffer capacity that will be returned to the [BUFFER_POOL]
+const BUFFER_POOL_MAX_CAPACITY: usize = 64 * 1024;
+
+thread_local! {
+    /// Spare buffers for holding partial names and arguments.
+    ///
+    /// This avoids repeatedly allocating and freeing them when messages
+    /// are split across calls to [Parser::append] or when parsers are
+    /// frequently created and destroyed. A parser is only used by one
+    /// thread at a time, so a thread-local pool avoids any locking.
+    static BUFFER_POOL: RefCell<Vec<Vec<u8>>> = const { RefCell::new(Vec::new()) };
+}
+
+/// Take an empty buffer from the [BUFFER_POOL], or create a new one.
+///
+/// This is also safe to use while the thread is exiting, after the pool
+/// has been destroyed.
+fn take_buffer() -> Vec<u8> {
+    BUFFER_POOL
+        .try_with(|pool| pool.borrow_mut().pop())
+        .ok()
+        .flatten()
+        .unwrap_or_default()
+}
+
+/// Return a buffer to the [BUFFER_POOL] (or free it, if the pool is full).
+///
+/// If the pool has already been destroyed (because the thread is exiting,
+/// and this was called from another thread-local's destructor), the buffer
+/// is just freed.
+fn return_buffer(mut buffer: Vec<u8>) {
+    if buffer.capacity() == 0 || buffer.capacity() > BUFFER_POOL_MAX_CAPACITY {
+        return;
+    }
+    buffer.clear();
+    let _ = BUFFER_POOL.try_with(|pool| {
+        let mut pool = pool.borrow_mut();
+        if pool.len() < BUFFER_POOL_SIZE {
+            pool.push(buffer);
+        }
+    });
+}
+
+/// Return the buffer owned by a [Cow] (if any) to the [BUFFER_POOL].
+fn return_cow(cow: Cow<'_, [u8]>) {
+    if let Cow::Owned(buffer) = cow {
+        return_buffer(buffer);
+    }
+}
+
+/// Convert a [Cow] to an owned vector, using a buffer from the [BUFFER_POOL]
+/// if a copy is needed.
+fn into_owned_pooled(cow: Cow<'_, [u8]>) -> Vec<u8> {
+    match cow {
+        Cow::Owned(buffer) => buffer,
+        Cow::Borrowed(elements) if elements.is_empty() => vec![],
+        Cow::Borrowed(elements) => {
+            let mut buffer = take_buffer();
+            buffer.extend_from_slice(elements);
+            buffer
+        }
+    }
+}
+
 /// Extend a `Cow<'_, [T]>` with new elements.
 ///
 /// This is special-cased to borrow the elements if the [Cow] was empty.
@@ -140,10 +213,19 @@ impl Parser {
         self.mtype = None;
         self.name.clear();
         self.mid = None;
-        self.arguments.clear();
+        self.arguments.drain(..).for_each(return_buffer);
         self.error = None;
     }
 
+    /// Return the memory held by a message to the parser's buffer pool.
+    ///
+    /// This is optional, but can reduce memory allocations when messages
+    /// are split across calls to [Parser::append].
+    pub fn recycle(message: ParsedMessage<'_>) {
+        return_cow(message.name);
+        message.arguments.into_iter().for_each(return_cow);
+    }
+
     /// Signal an error at a particular position on a line.
     fn error_at(&mut self, transient: &mut Transient, message: impl Into<String>, position: usize) {
         if self.state != State::ErrorEndOfLine {
@@ -153,8 +235,8 @@ impl Parser {
             self.error = Some(ParseError::new(message.into(), position));
         }
         // Free up some memory early
-        self.arguments.clear();
-        transient.arguments.clear();
+        self.arguments.drain(..).for_each(return_buffer);
+        transient.arguments.drain(..).for_each(return_cow);
     }
 
     /// Signal an error at the current position.
@@ -270,8 +352,20 @@ impl Parser {
                 } else {
                     std::cmp::min(data.len(), self.max_line_length - self.line_length)
                 };
-                while p < max_len && fast_table[data[p]] {
-                    p += 1;
+                if entry.state == State::Error {
+                    // Everything up to the end of the line is skipped, so
+                    // use a vectorised search for the end of line.
+                    p = match memchr2(b'\n', b'\r', &data[p..max_len]) {
+                        Some(pos) => p + pos,
+                        None => max_len,
+                    };
+                } else {
+                    if entry.state == State::Argument && entry.action == Action::Argument {
+                        p += argument_words_len(&data[p..max_len]);
+                    }
+                    while p < max_len && fast_table[data[p]] {
+                        p += 1;
+                    }
                 }
             }
 
@@ -296,11 +390,11 @@ impl Parser {
             }
         }
         // Return any leftover state to the primary parser state
-        self.name = std::mem::take(&mut transient.name).into_owned();
+        self.name = into_owned_pooled(std::mem::take(&mut transient.name));
         self.arguments.extend(
             std::mem::take(&mut transient.arguments)
                 .into_iter()
-                .map(|x| x.into_owned()),
+                .map(into_owned_pooled),
         );
         (None, data)
     }
@@ -334,39 +428,304 @@ impl Parser {
     }
 }
 
+impl Drop for Parser {
+    fn drop(&mut self) {
+        return_buffer(std::mem::take(&mut self.name));
+        self.arguments.drain(..).for_each(return_buffer);
+    }
+}
+
+/// Contiguous, immutable bytes obtained from a Python object.
+enum InputData<'py> {
+    /// A [bytes](PyBytes) object, either passed in or copied from the input
+    Bytes(Bound<'py, PyBytes>),
+    /// A C-contiguous buffer exported by a [memoryview](PyMemoryView) of
+    /// [bytes](PyBytes), which can be used without copying
+    #[cfg(not(Py_LIMITED_API))]
+    Buffer(PyBuffer<u8>),
+}
+
+impl<'py> InputData<'py> {
+    /// Obtain the bytes from an object supporting the buffer protocol.
+    ///
+    /// Only [bytes](PyBytes) objects and contiguous memoryviews of them are
+    /// used in place, since those are the only buffers known to be
+    /// immutable. Note that a buffer being read-only only describes the
+    /// view: a read-only memoryview of a bytearray can still be modified
+    /// through the bytearray. Everything else is copied, as are all
+    /// non-[bytes](PyBytes) objects when building against the limited API
+    /// (which doesn't provide the buffer protocol).
+    fn new(data: &Bound<'py, PyAny>) -> PyResult<Self> {
+        if let Ok(bytes) = data.downcast::<PyBytes>() {
+            return Ok(Self::Bytes(bytes.clone()));
+        }
+        #[cfg(not(Py_LIMITED_API))]
+        {
+            if let Ok(view) = data.downcast::<PyMemoryView>() {
+                if view
+                    .getattr(intern!(data.py(), "obj"))?
+                    .is_instance_of::<PyBytes>()
+                {
+                    // This fails if the format isn't compatible with u8
+                    // (for example, after memoryview.cast), in which case
+                    // the data is copied.
+                    if let Ok(buffer) = PyBuffer::<u8>::get_bound(view) {
+                        if buffer.is_c_contiguous() {
+                            return Ok(Self::Buffer(buffer));
+                        }
+                    }
+                }
+            }
+        }
+        let copy = PyMemoryView::from_bound(data)?.call_method0("tobytes")?;
+        Ok(Self::Bytes(copy.downcast_into::<PyBytes>()?))
+    }
+
+    fn as_bytes(&self) -> &[u8] {
+        match self {
+            Self::Bytes(bytes) => bytes.as_bytes(),
+            #[cfg(not(Py_LIMITED_API))]
+            Self::Buffer(buffer) => {
+                if buffer.len_bytes() == 0 {
+                    // buf_ptr() may be null in this case
+                    &[]
+                } else {
+                    // SAFETY: the buffer is C-contiguous, so it holds
+                    // len_bytes() bytes starting at buf_ptr(). It is
+                    // exported by a bytes object, which is immutable, so the
+                    // contents can't change while we hold it.
+                    unsafe {
+                        std::slice::from_raw_parts(
+                            buffer.buf_ptr() as *const u8,
+                            buffer.len_bytes(),
+                        )
+                    }
+                }
+            }
+        }
+    }
+}
+
+/// Number of entries in a [NameCache]
+const NAME_CACHE_SIZE: usize = 64;
+/// Longest name that will be stored in a [NameCache]
+const NAME_CACHE_MAX_LENGTH: usize = 32;
+
+/// Cache of Python [bytes](PyBytes) objects for recently-seen message names.
+///
+/// Real streams tend to repeat the same small set of names, so this avoids
+/// allocating a new Python object for each message. It is direct-mapped:
+/// each name can only be stored in one slot (determined by a hash), and
+/// replaces whatever was there before.
+struct NameCache {
+    entries: [Option<Py<PyBytes>>; NAME_CACHE_SIZE],
+}
+
+impl NameCache {
+    fn new() -> Self {
+        Self {
+            entries: std::array::from_fn(|_| None),
+        }
+    }
+
+    /// FNV-1a hash of the name.
+    fn hash(name: &[u8]) -> usize {
+        let mut hash: u32 = 0x811c9dc5;
+        for &c in name.iter() {
+            hash = (hash ^ (c as u32)).wrapping_mul(0x01000193);
+        }
+        hash as usize
+    }
+
+    /// Get a Python object for `name`, reusing a cached one if possible.
+    fn get<'py>(&mut self, py: Python<'py>, name: &[u8]) -> Bound<'py, PyBytes> {
+        if name.len() > NAME_CACHE_MAX_LENGTH {
+            return PyBytes::new_bound(py, name);
+        }
+        let slot = &mut self.entries[Self::hash(name) % NAME_CACHE_SIZE];
+        if let Some(cached) = slot.as_ref() {
+            let cached = cached.bind(py);
+            if cached.as_bytes() == name {
+                return cached.clone();
+            }
+        }
+        let bytes = PyBytes::new_bound(py, name);
+        *slot = Some(bytes.clone().unbind());
+        bytes
+    }
+}
+
+/// Number of entries in a [MidCache]
+const MID_CACHE_SIZE: usize = 64;
+/// Largest integer that CPython always caches itself
+const SMALL_INT_MAX: u32 = 256;
+
+/// Cache of Python integers for recently-seen message IDs.
+///
+/// Replies and informs repeat the message ID of the request they respond
+/// to, so a stream will often contain the same ID several times in quick
+/// succession. Like [NameCache], it is direct-mapped, with the slot
+/// determined by the ID modulo the cache size; sequential IDs thus occupy
+/// distinct slots. IDs up to [SMALL_INT_MAX] are not cached because CPython
+/// already returns shared objects for them.
+struct MidCache {
+    entries: [Option<(u32, PyObject)>; MID_CACHE_SIZE],
+}
+
+impl MidCache {
+    fn new() -> Self {
+        Self {
+            entries: std::array::from_fn(|_| None),
+        }
+    }
+
+    /// Get a Python object for `mid`, reusing a cached one if possible.
+    fn get(&mut self, py: Python<'_>, mid: Option<u32>) -> PyObject {
+        match mid {
+            None => py.None(),
+            Some(mid) if mid <= SMALL_INT_MAX => mid.into_py(py),
+            Some(mid) => {
+                let slot = &mut self.entries[mid as usize % MID_CACHE_SIZE];
+                if let Some((cached_mid, cached)) = slot.as_ref() {
+                    if *cached_mid == mid {
+                        return cached.clone_ref(py);
+                    }
+                }
+                let value = mid.into_py(py);
+                *slot = Some((mid, value.clone_ref(py)));
+                value
+            }
+        }
+    }
+}
+
+/// Smallest input for which [PyParser] releases the GIL while parsing.
+///
+/// For small inputs, the cost of releasing and reacquiring the GIL would
+/// outweigh the time spent parsing.
+const RELEASE_GIL_THRESHOLD: usize = 4096;
+
+/// Apply [Parser::recycle] to all the messages in a set of results.
+fn recycle_results(results: Vec<Result<ParsedMessage<'_>, ParseError>>) {
+    results.into_iter().flatten().for_each(Parser::recycle);
+}
+
+/// Parser type used for interaction with Python.
+#[pyclass(name = "Parser", module = "katcp_codec._lib")]
+pub struct PyParser {
+    parser: Parser,
+    names: NameCache,
+    mids: MidCache,
+}
+
+impl PyParser {
+    /// Parse `data` and collect the results.
+    ///
+    /// No Python objects are touched during parsing, so for large inputs
+    /// the GIL is released to allow other Python threads to run. That's safe
+    /// because [InputData] is immutable. While the GIL is released, the
+    /// parser remains mutably borrowed, so other threads trying to use the
+    /// same parser will get an error rather than waiting for it.
+    fn parse<'data>(
+        &mut self,
+        py: Python<'_>,
+        data: &'data InputData<'_>,
+    ) -> Vec<Result<ParsedMessage<'data>, ParseError>> {
+        let bytes = data.as_bytes();
+        let parser = &mut self.parser;
+        if bytes.len() >= RELEASE_GIL_THRESHOLD {
+            py.allow_threads(|| parser.append(bytes).collect())
+        } else {
+            parser.append(bytes).collect()
+        }
+    }
+
+    /// Convert a parsed message to a Python `katcp_codec.Message`.
+    fn message_to_py(&mut self, py: Python<'_>, message: &ParsedMessage<'_>) -> PyResult<PyObject> {
+        let name = self.names.get(py, message.name.as_ref());
+        let mid = self.mids.get(py, message.mid);
+        let arguments = PyList::new_bound(py, message.arguments.iter());
+        // The parser has already validated the name and message ID, so
+        // there is no need to run the Python constructor.
+        new_message(py, message.mtype, name, mid, arguments)
+    }
+
+    /// Convert a parse result to a `katcp_codec.Message` or [ValueError](PyValueError).
+    fn result_to_py(
+        &mut self,
+        py: Python<'_>,
+        result: &Result<ParsedMessage<'_>, ParseError>,
+    ) -> PyResult<PyObject> {
+        match result {
+            Ok(msg) => self.message_to_py(py, msg),
+            Err(error) => Ok(PyValueError::new_err(error.to_string())
+                .into_value(py)
+                .into_py(py)),
+        }
+    }
+}
+
 #[pymethods]
-impl Parser {
+impl PyParser {
     #[new]
     fn py_new(max_line_length: usize) -> Self {
-        Self::new(max_line_length)
+        Self {
+            parser: Parser::new(max_line_length),
+            names: NameCache::new(),
+            mids: MidCache::new(),
+        }
     }
 
-    // TODO: support buffer protocol?
+    /// Append data and return a list of `katcp_codec.Message` or [ValueError](PyValueError).
     #[pyo3(name = "append")]
-    fn py_append<'py>(&mut self, data: &Bound<'py, PyBytes>) -> PyResult<Bound<'py, PyList>> {
+    fn py_append<'py>(&mut self, data: &Bound<'py, PyAny>) -> PyResult<Bound<'py, PyList>> {
         let py = data.py();
-        let out = PyList::empty_bound(py);
-        for result in self.append(data.as_bytes()) {
-            match result {
-                Ok(msg) => {
-                    out.append(msg)?;
-                }
-                Err(error) => {
-                    out.append(PyValueError::new_err(error.to_string()).into_value(py))?;
-                }
-            }
+        let data = InputData::new(data)?;
+        // Parse everything before creating any Python objects, so that a
+        // Python error can't leave the parser partway through the data.
+        let results = self.parse(py, &data);
+        // Convert in a single pass, then create the list at its final size
+        // rather than growing it one message at a time.
+        let mut out = Vec::with_capacity(results.len());
+        for result in results.iter() {
+            out.push(self.result_to_py(py, result)?);
+        }
+        recycle_results(results);
+        Ok(PyList::new_bound(py, out))
+    }
+
+    /// Append data and pass each resulting `katcp_codec.Message` or
+    /// [ValueError](PyValueError) to `callback`.
+    ///
+    /// All the data is parsed before the callback is first invoked, so if
+    /// the callback raises an exception, the remaining results are
+    /// discarded but the parser state remains consistent.
+    #[pyo3(name = "append_into")]
+    fn py_append_into<'py>(
+        &mut self,
+        data: &Bound<'py, PyAny>,
+        callback: &Bound<'py, PyAny>,
+    ) -> PyResult<()> {
+        let py = data.py();
+        let data = InputData::new(data)?;
+        // The results may borrow from `data` while the callback runs. That
+        // is only safe because InputData guarantees it is immutable.
+        let results = self.parse(py, &data);
+        for result in results.iter() {
+            callback.call1((self.result_to_py(py, result)?,))?;
         }
-        Ok(out)
+        recycle_results(results);
+        Ok(())
     }
 
     #[pyo3(name = "reset")]
     fn py_reset(&mut self) {
-        self.reset();
+        self.parser.reset();
     }
 
     #[getter(buffer_size)]
     fn py_buffer_size(&self) -> usize {
-        self.buffer_size()
+        self.parser.buffer_size()
     }
 }
 
@@ -478,6 +837,72 @@ mod test {
         assert_eq!(messages.as_slice(), &[Ok(msg!(Request, b"hello123", None))]);
     }
 
+    /// Reference implementation of [argument_words_len] using the fast table
+    fn argument_words_len_reference(data: &[u8]) -> usize {
+        let fast_table = PARSER_TABLE[State::Argument][b'x'].fast_table.unwrap();
+        let words_len = data.len() / 8 * 8;
+        match data.iter().position(|&c| !fast_table[c]) {
+            Some(pos) if pos < words_len => pos,
+            _ => words_len,
+        }
+    }
+
+    #[rstest]
+    fn test_argument_words_len(
+        #[values(b' ', b'\t', b'\n', b'\r', b'\\', b'\0', b'\x1B')] special: u8,
+        #[values(0, 1, 5, 7, 8, 9, 15, 16, 19)] pos: usize,
+    ) {
+        let mut data = vec![b'x'; 20];
+        data[pos] = special;
+        assert_eq!(
+            argument_words_len(&data),
+            argument_words_len_reference(&data)
+        );
+    }
+
+    /// Check the assumption made when skipping over characters in the error state
+    #[test]
+    fn test_error_fast_table() {
+        let fast_table = PARSER_TABLE[State::Error][b'x'].fast_table.unwrap();
+        for c in 0..=255u8 {
+            assert_eq!(fast_table[c], c != b'\n' && c != b'\r');
+        }
+    }
+
+    #[test]
+    fn test_buffer_pool() {
+        let mut parser = Parser::new(usize::MAX);
+        let messages: Vec<_> = parser.append(b"?split-message arg").collect();
+        assert!(messages.is_empty());
+        // Returning the partial message to the pool should make its
+        // buffers available for the next message.
+        drop(parser);
+        let buffer = take_buffer();
+        assert!(buffer.is_empty());
+        assert!(buffer.capacity() > 0);
+    }
+
+    /// Drop a parser from a thread-local destructor, when the pool may
+    /// already have been destroyed.
+    #[test]
+    fn test_buffer_pool_thread_exit() {
+        thread_local! {
+            static PARSER: RefCell<Option<Parser>> = const { RefCell::new(None) };
+        }
+        std::thread::spawn(|| {
+            // Initialise PARSER before BUFFER_POOL (which is first used when
+            // the partial message is stored), so that with the usual reverse
+            // order of destruction it is destroyed after the pool.
+            PARSER.set(Some(Parser::new(usize::MAX)));
+            PARSER.with_borrow_mut(|parser| {
+                let parser = parser.as_mut().unwrap();
+                assert_eq!(parser.append(b"?split-message arg").count(), 0);
+            });
+        })
+        .join()
+        .unwrap();
+    }
+
     fn split_points_strategy(size: usize) -> impl Strategy<Value = Vec<usize>> {
         prop::collection::vec(1..(size - 1), 1..10).prop_map(move |mut x| {
             x.push(0);
@@ -504,6 +929,12 @@ mod test {
             assert!(matches!(messages.as_slice(), &[Ok(_)]));
         }
 
+        /// Test that the word-at-a-time argument scan matches the fast table
+        #[test]
+        fn argument_words(data in prop::collection::vec(any::<u8>(), 0..100)) {
+            assert_eq!(argument_words_len(&data), argument_words_len_reference(&data));
+        }
+
         /// Test that splitting a message doesn't change how it is parsed
         #[test]
         fn parse_split(input in split_message_strategy(), max_line_length in 1..1000usize) {
@@ -0,0 +1,75 @@
+/* Copyright (c) 2024, National Research Foundation (SARAO)
+ *
+ * Licensed under the BSD 3-Clause License (the "License"); you may not use
+ * this file except in compliance with the License. You may obtain a copy
+ * of the License at
+ *
+ *   https://opensource.org/licenses/BSD-3-Clause
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+//! Word-at-a-time scanning for the bytes that are special in arguments.
+//!
+//! The same set of bytes (space, tab, `\n`, `\r`, `\\`, NUL and ESC) ends a
+//! chunk of an argument when parsing and needs to be escaped when
+//! formatting.
+
+/// Count the leading bytes of `data` that are not special, examining 8
+/// bytes at a time.
+///
+/// Only whole 8-byte words are examined. If one of them contains a special
+/// byte, the return value is the position of the first such byte. Otherwise
+/// it is the length of the whole words, and the caller must check the
+/// remainder.
+pub(crate) fn argument_words_len(data: &[u8]) -> usize {
+    const LO: u64 = 0x0101_0101_0101_0101;
+    const HI: u64 = 0x8080_8080_8080_8080;
+
+    /// Set the high bit of each zero byte of `x`.
+    ///
+    /// This may also flag some bytes following a zero byte, but the lowest
+    /// flagged byte will always be the first zero byte.
+    #[inline]
+    fn zero_bytes(x: u64) -> u64 {
+        x.wrapping_sub(LO) & !x & HI
+    }
+
+    let mut len = 0;
+    for word in data.chunks_exact(8) {
+        let x = u64::from_le_bytes(word.try_into().unwrap());
+        let mut mask = zero_bytes(x); // NUL
+        for c in [b' ', b'\t', b'\n', b'\r', b'\\', b'\x1B'] {
+            mask |= zero_bytes(x ^ (LO * c as u64));
+        }
+        if mask != 0 {
+            return len + (mask.trailing_zeros() / 8) as usize;
+        }
+        len += 8;
+    }
+    len
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use crate::tables::ESCAPE_FLAG;
+    use proptest::prelude::*;
+
+    proptest! {
+        /// Test that the special bytes are exactly those that need escaping
+        #[test]
+        fn escape_flag(data in prop::collection::vec(any::<u8>(), 0..100)) {
+            let words_len = data.len() / 8 * 8;
+            let expected = match data.iter().position(|&c| ESCAPE_FLAG[c]) {
+                Some(pos) if pos < words_len => pos,
+                _ => words_len,
+            };
+            assert_eq!(argument_words_len(&data), expected);
+        }
+    }
+}